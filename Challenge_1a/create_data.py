@@ -1,10 +1,60 @@
 # create_dataset.py
 
-import pdfplumber
+import fitz  # PyMuPDF
 import json
 import pandas as pd
+import numpy as np
 import os
 import re
+import functools
+
+# Only text lines are used, so image blocks (and their pixel data) are left out of get_text().
+# Ligatures are expanded ('fi', not U+FB01) and text outside the media box is kept, so
+# line texts match the headings in the ground-truth JSON.
+_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~(fitz.TEXT_PRESERVE_IMAGES | fitz.TEXT_PRESERVE_LIGATURES
+                                      | fitz.TEXT_MEDIABOX_CLIP)
+# Section numbering such as '2' or '3.1.4' at the start of a line
+_NUMBERING_RE = re.compile(r'^\d+(?:\.\d+)*')
+
+# Bold check per font name; documents use only a handful of fonts, so lower() runs once per
+# name, and the bounded cache keeps long-lived Pool workers from accumulating every font seen
+@functools.lru_cache(maxsize=256)
+def is_bold_font(font_name):
+    """Returns True if the font name marks a bold face, memoized per name."""
+    return 'bold' in font_name.lower()
+
+def _page_lines(blocks, page_width, page_height):
+    """
+    Rebuilds a page's visual lines from its text spans, in reading order, and yields
+    (line_text, first_span, word_count, y_position, is_centered) for each. Spans are grouped
+    by the rounded top of their glyph box, so pieces PyMuPDF reports as separate lines at
+    the same height (e.g. a section number and its heading text) form one line.
+    """
+    spans = [span for block in blocks for line in block.get("lines", [])
+             for span in line["spans"] if span["text"].strip()]
+    if not spans:
+        return
+    geometry = np.array([(span['origin'][1], span['size'], span['descender'], span['bbox'][0], span['bbox'][2])
+                         for span in spans], dtype=np.float64)
+    origin_y, sizes, descenders, x0s, x1s = geometry.T
+    # Top of the glyph box: the baseline minus the font size above the descender
+    tops = np.rint(origin_y - sizes * (1.0 + descenders)).astype(np.int32)
+
+    # One lexsort orders the spans top to bottom, then left to right; a line starts wherever the top changes
+    order = np.lexsort((x0s, tops))
+    starts = np.flatnonzero(np.diff(tops[order])) + 1
+    firsts = order[np.r_[0, starts]]
+    lasts = order[np.r_[starts - 1, len(order) - 1]]
+
+    # The positional features are computed for the whole page at once
+    y_positions = (tops[firsts] / page_height).tolist()
+    centered = (np.abs(x0s[firsts] - (page_width - x1s[lasts])) < 0.2 * page_width).tolist()
+
+    for group, y_position, is_centered in zip(np.split(order, starts), y_positions, centered):
+        line_spans = [spans[i] for i in group.tolist()]
+        # Spans (and so font changes) are separated by a space, and runs of whitespace collapse to one
+        words = " ".join(span["text"] for span in line_spans).split()
+        yield " ".join(words), line_spans[0], len(words), y_position, is_centered
 
 def get_ground_truth(json_path):
     """
@@ -21,49 +71,34 @@ def get_ground_truth(json_path):
     # --- NEW: Create a set of all words in the title for multi-line matching ---
     title_text = data.get('title', '').strip()
     # Create a word set, ignoring very short words that might cause false positives
-    title_words = {word for word in title_text.split() if len(word) > 2} if title_text else set()
+    title_words = frozenset(word for word in title_text.split() if len(word) > 2) if title_text else frozenset()
     
     return heading_lookup, title_words, title_text
 
 def extract_features_and_labels(pdf_path, heading_lookup, title_words, full_title_text):
-    """Extracts features and labels for every line in the PDF."""
-    data_rows = []
+    """
+    Extracts features and labels for every line in the PDF.
+    Returns one array per column (struct-of-arrays) instead of a dict per line.
+    """
+    texts, font_sizes, bold_flags, word_counts, size_diffs = [], [], [], [], []
+    numbering_flags, y_positions, centered_flags, page_nums, labels = [], [], [], [], []
+    # Page-0 lines awaiting the title word-overlap check: flat candidate words, the
+    # candidate line each word belongs to, and each candidate line's row index
+    overlap_tokens, overlap_row_ids, overlap_rows = [], [], []
     
-    with pdfplumber.open(pdf_path) as pdf:
+    with fitz.open(pdf_path) as doc:
         previous_line_style = {'size': 0, 'fontname': ''}
         
-        for page_num, page in enumerate(pdf.pages):
-            page_width = page.width
-            words = page.extract_words(x_tolerance=2, y_tolerance=2, keep_blank_chars=False, extra_attrs=["fontname", "size"])
-            if not words:
-                continue
-
-            lines = {}
-            for word in words:
-                top = round(word['top'])
-                if top not in lines:
-                    lines[top] = []
-                lines[top].append(word)
-
-            for top in sorted(lines.keys()):
-                line_words = sorted(lines[top], key=lambda w: w['x0'])
-                line_text = " ".join(w['text'] for w in line_words).strip()
-                
-                if not line_text:
-                    continue
-
-                first_word = line_words[0]
-                last_word = line_words[-1]
-                font_size = first_word['size']
-                font_name = first_word['fontname']
-                is_bold = 'bold' in font_name.lower()
+        for page_num, page in enumerate(doc):
+            blocks = page.get_text("dict", flags=_TEXT_FLAGS)["blocks"]
+
+            for line_text, first_span, word_count, y_position, is_centered in _page_lines(
+                    blocks, page.rect.width, page.rect.height):
+                font_size = first_span['size']
+                font_name = first_span['font']
+                is_bold = is_bold_font(font_name)
                 size_diff_from_prev = font_size - previous_line_style['size']
-                word_count = len(line_words)
-                starts_with_numbering = bool(re.match(r'^\d+(\.\d+)*', line_text))
-                y_position = top / page.height
-                left_margin = first_word['x0']
-                right_margin = page_width - last_word['x1']
-                is_centered = abs(left_margin - right_margin) < 0.2 * page_width
+                starts_with_numbering = line_text[0].isdigit() and _NUMBERING_RE.match(line_text) is not None
 
                 # --- NEW, SMARTER LABELING LOGIC ---
                 label = 'paragraph' # Default label
@@ -76,47 +111,80 @@ def extract_features_and_labels(pdf_path, heading_lookup, title_words, full_titl
                     # Check for an exact match of the full title
                     if line_text == full_title_text:
                          label = 'Title'
-                    # Check for multi-line titles using word overlap
+                    # Multi-line titles are checked by word overlap after the loop, in one vectorized pass
                     else:
-                        line_word_set = {word for word in line_text.split() if len(word) > 2}
-                        # If more than 60% of the words in this line are in the title, label it as Title.
-                        # This threshold is robust to small mismatches.
-                        if len(line_word_set) > 0 and len(line_word_set.intersection(title_words)) / len(line_word_set) > 0.6:
-                            label = 'Title'
-
-                data_rows.append({
-                    'text': line_text, 'font_size': font_size, 'is_bold': is_bold,
-                    'word_count': word_count, 'size_diff_from_prev': size_diff_from_prev,
-                    'starts_with_numbering': starts_with_numbering, 'y_position': y_position,
-                    'is_centered': is_centered, 'page_num': page_num, 'label': label
-                })
+                        candidate_words = [word for word in line_text.split() if len(word) > 2]
+                        overlap_tokens.extend(candidate_words)
+                        overlap_row_ids.extend([len(overlap_rows)] * len(candidate_words))
+                        overlap_rows.append(len(labels))
+
+                texts.append(line_text)
+                font_sizes.append(font_size)
+                bold_flags.append(is_bold)
+                word_counts.append(word_count)
+                size_diffs.append(size_diff_from_prev)
+                numbering_flags.append(starts_with_numbering)
+                y_positions.append(y_position)
+                centered_flags.append(is_centered)
+                page_nums.append(page_num)
+                labels.append(label)
                 
                 previous_line_style = {'size': font_size, 'fontname': font_name}
+    # Drop the fonts and resources MuPDF cached for this document before opening the next
+    fitz.TOOLS.store_shrink(100)
+    
+    labels = np.array(labels, dtype=object)
+    if overlap_rows:
+        hits = np.isin(np.array(overlap_tokens, dtype=object), np.fromiter(title_words, dtype=object))
+        per_line_hits = np.bincount(overlap_row_ids, weights=hits, minlength=len(overlap_rows))
+        per_line_lens = np.bincount(overlap_row_ids, minlength=len(overlap_rows))
+        # If more than 60% of the words in a line are in the title, label it as Title.
+        # This threshold is robust to small mismatches.
+        with np.errstate(invalid='ignore', divide='ignore'):
+            is_title = (per_line_lens > 0) & (per_line_hits / per_line_lens > 0.6)
+        labels[np.array(overlap_rows)[is_title]] = 'Title'
     
-    return data_rows
+    # Float features are stored as float32, the precision the trees split on anyway
+    return {
+        'text': np.array(texts, dtype=object), 'font_size': np.array(font_sizes, dtype=np.float32),
+        'is_bold': np.array(bold_flags, dtype=np.bool_), 'word_count': np.array(word_counts, dtype=np.int16),
+        'size_diff_from_prev': np.array(size_diffs, dtype=np.float32),
+        'starts_with_numbering': np.array(numbering_flags, dtype=np.bool_),
+        'y_position': np.array(y_positions, dtype=np.float32), 'is_centered': np.array(centered_flags, dtype=np.bool_),
+        'page_num': np.array(page_nums, dtype=np.int32), 'label': labels
+    }
 
 # --- Main Execution (Updated to handle new return values) ---
 if __name__ == "__main__":
     PDF_DIR = 'D:/adobe-hackathon/Challenge_1a/sample_dataset/pdfs'
     JSON_DIR = 'D:/adobe-hackathon/Challenge_1a/sample_dataset/outputs'
     
-    all_data = []
+    all_columns = []
     
-    for pdf_filename in os.listdir(PDF_DIR):
-        if pdf_filename.endswith('.pdf'):
-            base_name = os.path.splitext(pdf_filename)[0]
-            pdf_path = os.path.join(PDF_DIR, pdf_filename)
-            json_path = os.path.join(JSON_DIR, f"{base_name}.json")
+    with os.scandir(PDF_DIR) as entries:
+        pdf_entries = [entry for entry in entries if entry.name.endswith('.pdf') and entry.is_file()]
+
+    for entry in pdf_entries:
+        base_name = os.path.splitext(entry.name)[0]
+        pdf_path = entry.path
+        json_path = os.path.join(JSON_DIR, f"{base_name}.json")
+        
+        if not os.path.exists(json_path):
+            print(f"Warning: No matching JSON for {entry.name}")
+            continue
             
-            if not os.path.exists(json_path):
-                print(f"Warning: No matching JSON for {pdf_filename}")
-                continue
-                
-            print(f"Processing {pdf_filename}...")
-            # --- CHANGE: Get the new outputs from the ground truth function ---
-            headings, title_words, full_title = get_ground_truth(json_path)
-            all_data.extend(extract_features_and_labels(pdf_path, headings, title_words, full_title))
-
-    df = pd.DataFrame(all_data)
-    df.to_csv('D:/adobe-hackathon/Challenge_1a/training_datas.csv', index=False, encoding='utf-8')
-    print("\nSuccessfully created training_data.csv")
\ No newline at end of file
+        print(f"Processing {entry.name}...")
+        # --- CHANGE: Get the new outputs from the ground truth function ---
+        headings, title_words, full_title = get_ground_truth(json_path)
+        all_columns.append(extract_features_and_labels(pdf_path, headings, title_words, full_title))
+
+    # Join the per-document columns; the dtypes are already set, so pandas has nothing to infer.
+    # With no matching PDF/JSON pairs an empty dataset is written, as before.
+    if all_columns:
+        df = pd.DataFrame({name: np.concatenate([columns[name] for columns in all_columns]) for name in all_columns[0]})
+    else:
+        print("Warning: No PDFs with matching JSON were found; the dataset is empty.")
+        df = pd.DataFrame()
+    # Parquet keeps the column dtypes and loads far faster than re-parsing a CSV
+    df.to_parquet('D:/adobe-hackathon/Challenge_1a/training_datas.parquet', index=False, compression='zstd')
+    print("\nSuccessfully created training_datas.parquet")
\ No newline at end of file
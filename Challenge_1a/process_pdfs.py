@@ -1,108 +1,252 @@
 # process_pdfs.py (Corrected logic, processing all files in a directory)
 
-import pdfplumber
-import json
-import pandas as pd
+import fitz  # PyMuPDF
+import orjson
+import numpy as np
 import os
 import re
 import joblib
 import sys
+import multiprocessing
+import warnings
+import hashlib
+import mmap
+import tempfile
+import functools
 
 # --- Load the trained model ---
 MODEL_PATH = 'heading_classifier.joblib'
-try:
-    model = joblib.load(MODEL_PATH)
-except FileNotFoundError:
-    sys.exit(f"Error: Model file not found at {MODEL_PATH}")
+model = None  # Loaded once per process by _load_model()
+
+# Column order of the feature matrix; must match the training script's features list
+FEATURE_ORDER = (
+    'font_size', 'is_bold', 'word_count', 'size_diff_from_prev',
+    'starts_with_numbering', 'y_position', 'is_centered'
+)
+
+def _load_model():
+    """Loads the classifier into this process once; also used as the worker Pool initializer."""
+    global model
+    if model is None:
+        model = joblib.load(MODEL_PATH)
+        # Features are passed as a bare array, so the column order must match training
+        if tuple(model.feature_names_in_) != FEATURE_ORDER:
+            raise ValueError(f"Model features {list(model.feature_names_in_)} do not match {list(FEATURE_ORDER)}")
+        # The forest is trained with n_jobs=-1; here each Pool worker already owns a core,
+        # so predict runs single-threaded instead of oversubscribing the CPU
+        model.n_jobs = 1
+
+# Extracted line features are cached here, keyed by the PDF's content hash.
+# Bump _CACHE_VERSION whenever feature extraction changes.
+CACHE_DIR = 'feature_cache'
+_CACHE_VERSION = 4
+
+# Only text lines are used, so image blocks (and their pixel data) are left out of get_text().
+# Ligatures are expanded ('fi', not U+FB01) and text outside the media box is kept, so
+# line texts match the headings in the ground-truth JSON.
+_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~(fitz.TEXT_PRESERVE_IMAGES | fitz.TEXT_PRESERVE_LIGATURES
+                                      | fitz.TEXT_MEDIABOX_CLIP)
+# Section numbering such as '2' or '3.1.4' at the start of a line
+_NUMBERING_RE = re.compile(r'^\d+(?:\.\d+)*')
+
+# Bold check per font name; documents use only a handful of fonts, so lower() runs once per
+# name, and the bounded cache keeps long-lived Pool workers from accumulating every font seen
+@functools.lru_cache(maxsize=256)
+def is_bold_font(font_name):
+    """Returns True if the font name marks a bold face, memoized per name."""
+    return 'bold' in font_name.lower()
+
+def _page_lines(blocks, page_width, page_height):
+    """
+    Rebuilds a page's visual lines from its text spans, in reading order, and yields
+    (line_text, first_span, word_count, y_position, is_centered) for each. Spans are grouped
+    by the rounded top of their glyph box, so pieces PyMuPDF reports as separate lines at
+    the same height (e.g. a section number and its heading text) form one line.
+    """
+    spans = [span for block in blocks for line in block.get("lines", [])
+             for span in line["spans"] if span["text"].strip()]
+    if not spans:
+        return
+    geometry = np.array([(span['origin'][1], span['size'], span['descender'], span['bbox'][0], span['bbox'][2])
+                         for span in spans], dtype=np.float64)
+    origin_y, sizes, descenders, x0s, x1s = geometry.T
+    # Top of the glyph box: the baseline minus the font size above the descender
+    tops = np.rint(origin_y - sizes * (1.0 + descenders)).astype(np.int32)
+
+    # One lexsort orders the spans top to bottom, then left to right; a line starts wherever the top changes
+    order = np.lexsort((x0s, tops))
+    starts = np.flatnonzero(np.diff(tops[order])) + 1
+    firsts = order[np.r_[0, starts]]
+    lasts = order[np.r_[starts - 1, len(order) - 1]]
+
+    # The positional features are computed for the whole page at once
+    y_positions = (tops[firsts] / page_height).tolist()
+    centered = (np.abs(x0s[firsts] - (page_width - x1s[lasts])) < 0.2 * page_width).tolist()
+
+    for group, y_position, is_centered in zip(np.split(order, starts), y_positions, centered):
+        line_spans = [spans[i] for i in group.tolist()]
+        # Spans (and so font changes) are separated by a space, and runs of whitespace collapse to one
+        words = " ".join(span["text"] for span in line_spans).split()
+        yield " ".join(words), line_spans[0], len(words), y_position, is_centered
+
+def _pdf_digest(pdf_path):
+    """SHA-1 of the PDF's bytes, hashed straight from a read-only memory map."""
+    with open(pdf_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha1(b'').hexdigest()  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return hashlib.sha1(m).hexdigest()
+
+def _extract_line_features(pdf_path):
+    """
+    Parses the PDF and returns its per-line features (columns in FEATURE_ORDER)
+    with each line's page number, y position and text (a list of str). No lines means the
+    PDF has no extractable text, so no separate pre-scan of the pages is needed.
+    """
+    with fitz.open(pdf_path) as doc:
+        # Parse every page once; the dicts serve both sizing the feature matrix and filling it
+        page_dicts = [page.get_text("dict", flags=_TEXT_FLAGS) for page in doc]
+    # Drop the fonts and resources MuPDF cached for this document, so a Pool worker that
+    # handles many PDFs does not keep every document's objects resident
+    fitz.TOOLS.store_shrink(100)
+
+    previous_line_style = {'size': 0, 'fontname': ''}
+    # Features are written into a preallocated matrix (one row per line, sized for the
+    # upper bound of one line per span) and classified in a single batch afterwards
+    max_lines = sum(len(line["spans"]) for page_dict in page_dicts
+                    for block in page_dict["blocks"] for line in block.get("lines", []))
+    features = np.empty((max_lines, len(FEATURE_ORDER)), dtype=np.float32)
+    n_lines = 0
+    page_nums = []
+    y_positions = []
+    line_texts = []
+    
+    for page_num, page_dict in enumerate(page_dicts):
+        for line_text, first_span, word_count, y_position, is_centered in _page_lines(
+                page_dict["blocks"], page_dict["width"], page_dict["height"]):
+            # --- FEATURE EXTRACTION (Must match the training script) ---
+            font_size = first_span['size']
+            font_name = first_span['font']
+            is_bold = is_bold_font(font_name)
+            size_diff_from_prev = font_size - previous_line_style['size']
+            starts_with_numbering = line_text[0].isdigit() and _NUMBERING_RE.match(line_text) is not None
+            
+            features[n_lines] = (
+                font_size, is_bold, word_count, 
+                size_diff_from_prev, starts_with_numbering,
+                y_position, is_centered
+            )
+            n_lines += 1
+            page_nums.append(page_num)
+            y_positions.append(y_position)
+            line_texts.append(line_text)
+            
+            previous_line_style = {'size': font_size, 'fontname': font_name}
+
+    return features[:n_lines], np.array(page_nums, dtype=np.int32), np.array(y_positions), line_texts
+
+def _pack_texts(line_texts):
+    """Packs the line texts into one UTF-8 byte array plus offsets, with no per-line padding."""
+    encoded = [text.encode('utf-8') for text in line_texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def _unpack_texts(text_bytes, text_offsets):
+    """Inverse of _pack_texts()."""
+    blob = text_bytes.tobytes()
+    offsets = text_offsets.tolist()
+    return [blob[start:stop].decode('utf-8') for start, stop in zip(offsets, offsets[1:])]
+
+def _prune_feature_cache():
+    """Removes cache entries written by other _CACHE_VERSIONs and leftover temporary files."""
+    if not os.path.isdir(CACHE_DIR):
+        return
+    current_suffix = f".v{_CACHE_VERSION}.npz"
+    with os.scandir(CACHE_DIR) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith(current_suffix):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+def _load_line_features(pdf_path):
+    """
+    Returns _extract_line_features() for the PDF, cached on disk by content hash
+    so that rerunning over the same inputs skips parsing entirely. The cache is only
+    an optimization: an unreadable or unwritable cache entry is treated as a miss.
+    """
+    cache_path = os.path.join(CACHE_DIR, f"{_pdf_digest(pdf_path)}.v{_CACHE_VERSION}.npz")
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                line_texts = _unpack_texts(cached['text_bytes'], cached['text_offsets'])
+                return cached['features'], cached['page_nums'], cached['y_positions'], line_texts
+        except Exception as e:
+            print(f"Warning: ignoring unreadable feature cache {cache_path}: {e}")
+
+    features, page_nums, y_positions, line_texts = _extract_line_features(pdf_path)
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temporary file and rename it into place, so concurrent workers and
+        # interrupted runs never leave a partially written entry at cache_path
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        text_bytes, text_offsets = _pack_texts(line_texts)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, features=features, page_nums=page_nums, y_positions=y_positions,
+                                text_bytes=text_bytes, text_offsets=text_offsets)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"Warning: could not write feature cache {cache_path}: {e}")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return features, page_nums, y_positions, line_texts
 
 def process_pdfs(pdf_path):
     """
     Processes a new PDF and predicts its structure using the trained model.
     Applies logic to differentiate between titles and bottom-of-page headings.
     """
+    _load_model()
     outline = []
     potential_title_parts = []
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            # Check if the PDF contains any extractable text to avoid errors
-            if not any(page.extract_text(x_tolerance=2) for page in pdf.pages):
-                 print(f"Warning: PDF '{os.path.basename(pdf_path)}' has no extractable text.")
-                 return {"title": "", "outline": []}
+        features, page_nums, y_positions, line_texts = _load_line_features(pdf_path)
+        if len(line_texts) == 0:
+             print(f"Warning: PDF '{os.path.basename(pdf_path)}' has no extractable text.")
+             return {"title": "", "outline": []}
 
-            previous_line_style = {'size': 0, 'fontname': ''}
-            
-            for page_num, page in enumerate(pdf.pages):
-                page_width = page.width
-                page_height = page.height
-                
-                # Extract words to reconstruct lines accurately
-                words = page.extract_words(x_tolerance=2, y_tolerance=2, keep_blank_chars=False, extra_attrs=["fontname", "size"])
-                if not words:
-                    continue
-
-                # Group words into lines based on their vertical position
-                lines = {}
-                for word in words:
-                    top = round(word['top'])
-                    if top not in lines:
-                        lines[top] = []
-                    lines[top].append(word)
-
-                for top in sorted(lines.keys()):
-                    line_words = sorted(lines[top], key=lambda w: w['x0'])
-                    line_text = " ".join(w['text'] for w in line_words).strip()
-                    
-                    if not line_text:
-                        continue
-
-                    # --- FEATURE EXTRACTION (Must match the training script) ---
-                    first_word = line_words[0]
-                    last_word = line_words[-1]
-                    
-                    font_size = first_word['size']
-                    font_name = first_word['fontname']
-                    is_bold = 'bold' in font_name.lower()
-                    size_diff_from_prev = font_size - previous_line_style['size']
-                    word_count = len(line_words)
-                    starts_with_numbering = bool(re.match(r'^\d+(\.\d+)*', line_text))
-                    y_position = top / page_height
-                    left_margin = first_word['x0']
-                    right_margin = page_width - last_word['x1']
-                    is_centered = abs(left_margin - right_margin) < 0.2 * page_width
-                    
-                    # Create a feature vector for the model
-                    feature_vector = pd.DataFrame([[
-                        font_size, is_bold, word_count, 
-                        size_diff_from_prev, starts_with_numbering,
-                        y_position, is_centered
-                    ]], columns=model.feature_names_in_)
-
-                    # Predict the label for the line
-                    predicted_label = model.predict(feature_vector)[0]
-
-                    # --- LOGIC TO HANDLE PREDICTIONS ---
-                    # If the model predicts 'Title', apply the positional check.
-                    if predicted_label == 'Title' and page_num == 0:
-                        # A true title should be in the top half of the first page.
-                        if y_position < 0.5:
-                            potential_title_parts.append(line_text)
-                        else:
-                            # If it's in the bottom half, it's a heading, not a title.
-                            # Reclassify it as H1 to match the desired output format.
-                            outline.append({
-                                "level": "H1", 
-                                "text": line_text, 
-                                "page": page_num # Use 0-based index for consistency
-                            })
-                    elif predicted_label in ['H1', 'H2', 'H3']:
-                        outline.append({
-                            "level": predicted_label, 
-                            "text": line_text, 
-                            "page": page_num
-                        })
-                    
-                    previous_line_style = {'size': font_size, 'fontname': font_name}
+        # Predict the labels for all lines at once. The columns follow FEATURE_ORDER, checked
+        # against the model on load, so the array (float32, the dtype the trees use
+        # internally) replaces a DataFrame and sklearn's feature-name warning is silenced.
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="X does not have valid feature names")
+            predicted_labels = model.predict(features)
+
+        for predicted_label, page_num, y_position, line_text in zip(predicted_labels, page_nums.tolist(), y_positions.tolist(), line_texts):
+            # --- LOGIC TO HANDLE PREDICTIONS ---
+            # If the model predicts 'Title', apply the positional check.
+            if predicted_label == 'Title' and page_num == 0:
+                # A true title should be in the top half of the first page.
+                if y_position < 0.5:
+                    potential_title_parts.append(line_text)
+                else:
+                    # If it's in the bottom half, it's a heading, not a title.
+                    # Reclassify it as H1 to match the desired output format.
+                    outline.append({
+                        "level": "H1", 
+                        "text": line_text, 
+                        "page": page_num # Use 0-based index for consistency
+                    })
+            elif predicted_label in ['H1', 'H2', 'H3']:
+                outline.append({
+                    "level": predicted_label, 
+                    "text": line_text, 
+                    "page": page_num
+                })
 
     except Exception as e:
         print(f"Error processing {os.path.basename(pdf_path)}: {e}")
@@ -117,29 +261,49 @@ def process_pdfs(pdf_path):
     return {"title": doc_title, "outline": outline}
 
 
+def _process_file(pdf_path):
+    """Pool task: returns the path with its result so unordered results can be matched to files."""
+    print(f"Processing {os.path.basename(pdf_path)}...")
+    return pdf_path, process_pdfs(pdf_path)
+
+
 # --- Main execution block to process all PDFs in a directory ---
 if __name__ == "__main__":
     INPUT_DIR = 'sample_dataset/pdfs'
     OUTPUT_DIR = 'sample_dataset/outputs'
     
+    if not os.path.exists(MODEL_PATH):
+        sys.exit(f"Error: Model file not found at {MODEL_PATH}")
+
+    # Load and validate the model here first: an exception inside the Pool initializer
+    # would make the pool respawn workers forever instead of stopping the run
+    try:
+        _load_model()
+    except Exception as e:
+        sys.exit(f"Error: Could not load model from {MODEL_PATH}: {e}")
+
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
 
-    # Loop through all files in the input directory
-    for filename in os.listdir(INPUT_DIR):
-        if filename.endswith('.pdf'):
-            print(f"Processing {filename}...")
-            pdf_path = os.path.join(INPUT_DIR, filename)
-            
-            # Get the structured data from the prediction function
-            result = process_pdfs(pdf_path)
-            
+    # Entries from older feature-extraction versions would never be read again
+    _prune_feature_cache()
+
+    # scandir's entries carry the file type from the directory listing, so no extra stat per file
+    with os.scandir(INPUT_DIR) as entries:
+        pdf_paths = [entry.path for entry in entries if entry.name.endswith('.pdf') and entry.is_file()]
+
+    # PDFs are independent, so they are processed in parallel, one worker per core.
+    # Each worker loads the model once in the initializer instead of receiving it per task
+    # (a no-op for forked workers, which inherit the model loaded above).
+    with multiprocessing.Pool(initializer=_load_model) as pool:
+        # Results are written as soon as each PDF finishes, in completion order
+        for pdf_path, result in pool.imap_unordered(_process_file, pdf_paths):
             # Define the output path for the corresponding JSON file
-            output_filename = os.path.splitext(filename)[0] + '.json'
+            output_filename = os.path.splitext(os.path.basename(pdf_path))[0] + '.json'
             output_path = os.path.join(OUTPUT_DIR, output_filename)
             
-            # Save the result to a JSON file
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=4)
+            # Save the result to a JSON file; orjson serializes straight to UTF-8 bytes
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
             
-            print(f"Saved output to {output_path}")
\ No newline at end of file
+            print(f"Saved output to {output_path}")
@@ -1,14 +1,12 @@
 # train_model.py
 
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report
 import joblib
 
-# Load the dataset
-df = pd.read_csv('D:/adobe-hackathon/Challenge_1a/training_datas.csv')
-
 # --- CHANGE: Add the new features to the list ---
 features = [
     'font_size', 
@@ -21,19 +19,31 @@ features = [
 ]
 target = 'label'
 
+# Load the dataset. Parquet (written by create_data.py) keeps the column dtypes; only the
+# model's columns are read, and the label (five heading classes) is converted to a
+# categorical, stored as int8 codes instead of Python strings.
+df = pd.read_parquet('D:/adobe-hackathon/Challenge_1a/training_datas.parquet', columns=features + [target])
+df[target] = df[target].astype('category')
+
 # The rest of the script is unchanged
-X = df[features]
+# float32 is the dtype the trees are built on, so this avoids a float64 copy inside fit
+X = df[features].astype(np.float32)
 y = df[target]
 
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
 
 print("Training model...")
-model = RandomForestClassifier(n_estimators=100, random_state=42, class_weight='balanced')
+model = RandomForestClassifier(n_estimators=100, random_state=42, class_weight='balanced', n_jobs=-1)
 model.fit(X_train, y_train)
 
 print("\nEvaluating model on test data...")
 y_pred = model.predict(X_test)
 print(classification_report(y_test, y_pred))
 
+# The held-out split above only measures the model; the shipped model is refit on every
+# labeled line, since headings are rare and each document's headings are worth keeping
+print("Refitting on the full dataset...")
+model.fit(X, y)
+
 joblib.dump(model, 'D:/adobe-hackathon/Challenge_1a/heading_classifier.joblib')
 print("\nModel saved to heading_classifier.joblib")
\ No newline at end of file
@@ -1,20 +1,46 @@
-import argparse
-import json
 import os
+
+# Must be set before torch is imported, or the CUDA probe may already have run
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import argparse
 import re
 import uuid
 import statistics
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
 import fitz  # PyMuPDF
+import numpy as np
 import ollama
+import torch
+from rank_bm25 import BM25Okapi
 from sentence_transformers import CrossEncoder
 
-os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+# Bound intra-op threads so CrossEncoder matmuls don't oversubscribe many-core hosts
+torch.set_num_threads(min(8, os.cpu_count() or 1))
+torch.set_num_interop_threads(1)
+
 # --- Constants ---
 MAX_PAGES_TO_SCAN = 50  # Per document
+MEDIAN_PAGES = 5  # Leading pages whose span font sizes feed the median
+MEDIAN_SAMPLE_SIZE = 2000  # Span font sizes sampled for the median
+PER_PDF_THRESHOLD = 10  # Collections with more PDFs than this are parsed one PDF per task
+PAGES_PER_TASK = 10  # Page range parsed by one worker when a collection has few PDFs
+BM25_TOP_K = 50  # Sections passed from the lexical prefilter to the CrossEncoder
+ENCODER_BATCH_SIZE = 64
+ENCODER_MAX_CHARS = 512  # Section text is truncated before tokenization to limit padding
+QUANTIZE_ENCODER = True  # int8 dynamic quantization; set False to rank with the float32 model
+
+# --- Patterns ---
+_INDEX_RE = re.compile(r'-?\d+')  # Integers in the LLM's ranking response
+_WORD_RE = re.compile(r'\w+')  # Tokens for the BM25 prefilter
+
+# Segmentation only reads text blocks, so image blocks (and their pixel bytes, which page-range
+# workers would otherwise pickle back) are left out of get_text()
+_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
 
 # --- LLM Prompts ---
 
@@ -36,97 +62,186 @@ Example: [3, 1, 0, 2]
 """
 
 
-# --- Core Functions ---
+# --- Models ---
+
+_ENCODER = None
+
+def _get_encoder() -> CrossEncoder:
+    """
+    Loads the CrossEncoder on first use and reuses it for every later collection.
+    Unless QUANTIZE_ENCODER is off, the Linear layers are dynamically quantized to int8,
+    which CPUs with VNNI/AMX run several times faster than float32.
+    """
+    global _ENCODER
+    if _ENCODER is None:
+        encoder = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2", device="cpu", max_length=256)
+        if QUANTIZE_ENCODER:
+            # Eager-mode dynamic quantization, which newer torch releases deprecate ahead of
+            # removal; requirements.txt pins a torch version that fully supports it
+            encoder.model = torch.ao.quantization.quantize_dynamic(
+                encoder.model, {torch.nn.Linear}, dtype=torch.qint8)
+        _ENCODER = encoder
+    return _ENCODER
 
-def _calculate_median_font_size(doc: fitz.Document) -> float:
-    """Calculates the median font size across the first few pages."""
-    font_sizes = []
-    for page_num in range(min(len(doc), 5)):
-        page = doc[page_num]
-        try:
-            blocks = page.get_text("dict")["blocks"]
-            for block in blocks:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            font_sizes.append(span["size"])
-        except Exception:
-            continue
-    return statistics.median(font_sizes) if font_sizes else 12.0
 
-def _is_heading(block: Dict, median_font_size: float) -> bool:
+# --- Core Functions ---
+
+def _is_heading(first_span_style: Optional[Tuple[float, int]], median_font_size: float) -> bool:
     """Heuristic: Text is a heading if its font is larger or bold."""
-    if not block.get("lines") or not block["lines"][0].get("spans"):
+    if first_span_style is None:
         return False
-    first_span = block["lines"][0]["spans"][0]
+    size, flags = first_span_style
     # A heading is likely larger OR bold (flag 16)
-    is_bold = first_span["flags"] & 16
-    is_large = first_span["size"] > median_font_size * 1.15
+    is_bold = flags & 16
+    is_large = size > median_font_size * 1.15
     return is_large or is_bold
 
-def extract_document_structure(pdf_path: str) -> Dict:
-    """Extracts structured sections (heading + content) from a PDF."""
-    try:
-        doc = fitz.open(pdf_path)
-    except Exception as e:
-        print(f"Could not open {pdf_path}: {e}")
-        return {"title": os.path.basename(pdf_path), "sections": []}
+# One parsed page: (text, first span (size, flags)) per non-empty text block, and the
+# page's span font sizes (collected for the first MEDIAN_PAGES pages only)
+PageRecord = Tuple[List[Tuple[str, Optional[Tuple[float, int]]]], List[float]]
+
+def _extract_page_records(doc: fitz.Document, start: int, stop: int) -> List[PageRecord]:
+    """
+    Parses pages [start, stop) and reduces each to what segmentation reads, so page-range
+    workers send back these small records rather than full text dicts.
+    """
+    page_records = []
+    for page_num, page in enumerate(doc.pages(start, stop), start):
+        try:
+            blocks = page.get_text("dict", flags=_TEXT_FLAGS)["blocks"]
+        except Exception:
+            blocks = []
+        text_blocks = []
+        font_sizes = []
+        for block in blocks:
+            if "lines" not in block:
+                continue
+            if page_num < MEDIAN_PAGES and len(font_sizes) < MEDIAN_SAMPLE_SIZE:
+                font_sizes.extend(span["size"] for line in block["lines"] for span in line["spans"])
+            text = " ".join(span["text"] for line in block["lines"] for span in line["spans"]).strip()
+            if not text:
+                continue
+            first_line_spans = block["lines"][0]["spans"]
+            first_span = first_line_spans[0] if first_line_spans else None
+            text_blocks.append((text, (first_span["size"], first_span["flags"]) if first_span else None))
+        page_records.append((text_blocks, font_sizes))
+    return page_records
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[PageRecord]:
+    """Process-pool task: opens the PDF in the worker and parses one page range."""
+    with fitz.open(pdf_path) as doc:
+        return _extract_page_records(doc, start, stop)
+
+def _build_structure(pdf_path: str, page_records: List[PageRecord], page_count: int) -> Dict:
+    """Segments parsed page records into sections (heading + content)."""
+    # The same records feed both the median font size estimate (first MEDIAN_PAGES pages)
+    # and the section segmentation below.
+    # The median settles long before MEDIAN_SAMPLE_SIZE spans, so sampling stops there,
+    # even part-way through a dense page; median_low then picks from the partial sample
+    font_sizes = list(itertools.islice(
+        itertools.chain.from_iterable(sizes for _, sizes in page_records[:MEDIAN_PAGES]), MEDIAN_SAMPLE_SIZE))
+    median_font_size = statistics.median_low(font_sizes) if font_sizes else 12.0
 
-    median_font_size = _calculate_median_font_size(doc)
     doc_title = os.path.basename(pdf_path)
     
     structure = {"title": doc_title, "sections": []}
     current_heading = "Introduction"
     current_content = []
     
-    for page_num in range(min(len(doc), MAX_PAGES_TO_SCAN)):
-        page = doc[page_num]
-        try:
-            blocks = page.get_text("dict")["blocks"]
-            for block in blocks:
-                if "lines" in block:
-                    text = " ".join([span["text"] for line in block["lines"] for span in line["spans"]]).strip()
-                    if not text:
-                        continue
-
-                    if _is_heading(block, median_font_size):
-                        if current_heading and current_content:
-                            structure["sections"].append({
-                                "heading": current_heading,
-                                "content": " ".join(current_content),
-                                "page": page_num
-                            })
-                        current_content = []
-                        current_heading = text
-                    else:
-                        current_content.append(text)
-        except Exception:
-            continue
+    for page_num, (text_blocks, _) in enumerate(page_records):
+        for text, first_span_style in text_blocks:
+            if _is_heading(first_span_style, median_font_size):
+                if current_heading and current_content:
+                    structure["sections"].append({
+                        "heading": current_heading,
+                        "content": " ".join(current_content),
+                        "page": page_num
+                    })
+                current_content = []
+                current_heading = text
+            else:
+                current_content.append(text)
 
     if current_heading and current_content:
         structure["sections"].append({
             "heading": current_heading,
             "content": " ".join(current_content),
-            "page": len(doc)-1
+            "page": page_count-1
         })
         
     return structure
 
-def call_llm_for_ranking(prompt: str) -> List[int]:
-    """Safely calls the LLM for a JSON list of indices and handles errors."""
+def extract_document_structure(pdf_path: str) -> Dict:
+    """Extracts structured sections (heading + content) from a PDF."""
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        print(f"Could not open {pdf_path}: {e}")
+        return {"title": os.path.basename(pdf_path), "sections": []}
+
+    with doc:
+        page_records = _extract_page_records(doc, 0, MAX_PAGES_TO_SCAN)
+        return _build_structure(pdf_path, page_records, len(doc))
+
+def _extract_structures_by_page_range(pdf_paths: list, executor: ProcessPoolExecutor) -> List[Dict]:
+    """
+    Parses a few PDFs by spreading PAGES_PER_TASK-page ranges over the pool, so that
+    even a single large PDF uses every worker. Segmentation carries state from page
+    to page and runs afterwards in this process.
+    """
+    page_counts = {}
+    for pdf_path in pdf_paths:
+        try:
+            with fitz.open(pdf_path) as doc:
+                page_counts[pdf_path] = len(doc)
+        except Exception as e:
+            print(f"Could not open {pdf_path}: {e}")
+
+    futures = {
+        pdf_path: [
+            executor.submit(_extract_page_range, pdf_path, start, min(start + PAGES_PER_TASK, MAX_PAGES_TO_SCAN, page_count))
+            for start in range(0, min(page_count, MAX_PAGES_TO_SCAN), PAGES_PER_TASK)
+        ]
+        for pdf_path, page_count in page_counts.items()
+    }
+
+    structures = []
+    for pdf_path in pdf_paths:
+        if pdf_path not in page_counts:
+            structures.append({"title": os.path.basename(pdf_path), "sections": []})
+            continue
+        # A range that fails only empties this PDF's sections, as in extract_document_structure
+        try:
+            page_records = [record for future in futures[pdf_path] for record in future.result()]
+        except Exception as e:
+            print(f"Could not parse {pdf_path}: {e}")
+            structures.append({"title": os.path.basename(pdf_path), "sections": []})
+            continue
+        structures.append(_build_structure(pdf_path, page_records, page_counts[pdf_path]))
+    return structures
+
+def call_llm_for_ranking(prompt: str, num_candidates: int) -> List[int]:
+    """
+    Calls the LLM for a list of indices and handles errors.
+    Indices are pulled out with a regex so prose around the list doesn't discard the ranking.
+    """
     try:
         response = ollama.chat(
             model="tinyllama:1.1b-chat-v0.6-q2_K",
             messages=[{"role": "user", "content": prompt}],
             format="json"
         )
-        ranked_indices = json.loads(response["message"]["content"])
-        if isinstance(ranked_indices, list) and all(isinstance(i, int) for i in ranked_indices):
-            return ranked_indices
-        else:
-            print("LLM did not return a valid list of integers.")
-            return []
-    except (json.JSONDecodeError, KeyError, Exception) as e:
+        seen = set()
+        ranked_indices = []
+        for match in _INDEX_RE.findall(response["message"]["content"]):
+            index = int(match)
+            if 0 <= index < num_candidates and index not in seen:
+                seen.add(index)
+                ranked_indices.append(index)
+        if not ranked_indices:
+            print("LLM did not return any valid indices.")
+        return ranked_indices
+    except (KeyError, Exception) as e:
         print(f"LLM ranking failed: {e}.")
         return []
 
@@ -147,33 +262,45 @@ def run_hybrid_analysis(structures: List[Dict], persona: str, task: str) -> dict
         print("No sections were extracted from the documents.")
         return {"extracted_sections": [], "sub_section_analysis": []}
 
-    # Step 1: Fast Semantic Search with CrossEncoder
-    print(f"Performing fast semantic search on {len(all_sections)} sections...")
-    encoder = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2", device = "cpu")
-    
-    contents_to_rank = [f"{section['heading']}\n{section['content']}" for section in all_sections]
-    cross_encoder_scores = encoder.predict([(super_query, content) for content in contents_to_rank])
+    # Filter out low-value sections like "Introduction" and "Conclusion" before any scoring
+    blacklist = frozenset(["introduction", "conclusion", "references", "abstract"])
+    candidate_sections = [
+        section for section in all_sections
+        if section['heading'].lower().strip() not in blacklist
+    ]
+
+    if not candidate_sections:
+        print("No high-value sections found after filtering. Using original candidates.")
+        candidate_sections = all_sections
+
+    # Step 1: Cheap BM25 prefilter so the CrossEncoder only scores the lexical top-K
+    if len(candidate_sections) > BM25_TOP_K:
+        tokenized_sections = [_WORD_RE.findall(f"{section['heading']} {section['content']}".lower()) for section in candidate_sections]
+        bm25_scores = BM25Okapi(tokenized_sections).get_scores(_WORD_RE.findall(super_query.lower()))
+        top_k_indices = np.argsort(bm25_scores)[-BM25_TOP_K:]
+        # Keep document order so ties in the CrossEncoder ranking resolve as before
+        candidate_sections = [candidate_sections[i] for i in sorted(top_k_indices)]
+
+    # Step 2: Fast Semantic Search with CrossEncoder
+    print(f"Performing fast semantic search on {len(candidate_sections)} of {len(all_sections)} sections...")
+    contents_to_rank = [f"{section['heading']}\n{section['content']}"[:ENCODER_MAX_CHARS] for section in candidate_sections]
+    with torch.inference_mode():
+        cross_encoder_scores = _get_encoder().predict(
+            [(super_query, content) for content in contents_to_rank],
+            batch_size=ENCODER_BATCH_SIZE,
+            show_progress_bar=False,
+            convert_to_numpy=True
+        )
     
     semantically_ranked_chunks = sorted(
-        zip(all_sections, cross_encoder_scores),
+        zip(candidate_sections, cross_encoder_scores),
         key=lambda x: x[1],
         reverse=True
     )
 
-    # Filter out low-value sections like "Introduction" and "Conclusion"
-    # print("✅ Filtering out generic sections like 'Introduction' and 'Conclusion'...")
-    blacklist = ["introduction", "conclusion", "references", "abstract"]
-    high_value_candidates = [
-        section for section, score in semantically_ranked_chunks 
-        if section['heading'].lower().strip() not in blacklist
-    ][:20] # Take the top 20 high-value candidates
-
-    if not high_value_candidates:
-        print("No high-value sections found after filtering. Using original candidates.")
-        high_value_candidates = [section for section, score in semantically_ranked_chunks[:20]]
-
+    high_value_candidates = [section for section, score in semantically_ranked_chunks[:20]] # Take the top 20 high-value candidates
 
-    # Step 2: Intelligent Persona Ranking with LLM
+    # Step 3: Intelligent Persona Ranking with LLM
     # print(f"🤖 Using LLM to 'think' and re-rank {len(high_value_candidates)} candidate sections...")
     
     sections_for_prompt = "\n".join([f"{i}: {s['heading']} - {s['content'][:150]}..." for i, s in enumerate(high_value_candidates)])
@@ -184,17 +311,20 @@ def run_hybrid_analysis(structures: List[Dict], persona: str, task: str) -> dict
         sections_to_rank=sections_for_prompt
     )
     
-    ranked_indices = call_llm_for_ranking(rerank_prompt)
+    ranked_indices = call_llm_for_ranking(rerank_prompt, len(high_value_candidates))
     
     if ranked_indices:
-        final_ranked_sections = [high_value_candidates[i] for i in ranked_indices if i < len(high_value_candidates)]
-        final_ranked_sections.extend([s for s in high_value_candidates if s not in final_ranked_sections])
+        # LLM order first, then any candidates it left out, in CrossEncoder order.
+        # Membership is tracked by index, avoiding list scans that compare whole dicts.
+        ranked_set = set(ranked_indices)
+        final_ranked_sections = [high_value_candidates[i] for i in ranked_indices]
+        final_ranked_sections.extend(s for i, s in enumerate(high_value_candidates) if i not in ranked_set)
         print(f"LLM successfully re-ranked the sections.")
     else:
         print("Falling back to CrossEncoder ranking due to LLM failure.")
         final_ranked_sections = high_value_candidates
 
-    # Step 3: Generate Final Output
+    # Step 4: Generate Final Output
     print("Formatting top sections and subsections...")
     extracted_sections_out = []
     sub_section_analysis_out = []
@@ -221,8 +351,17 @@ def run_hybrid_analysis(structures: List[Dict], persona: str, task: str) -> dict
 def process_pdfs(pdf_paths: list, persona: str, task: str) -> dict:
     """Runs the entire analysis pipeline from PDF processing to final output generation."""
     print("--- Step 1: Extracting Document Structures ---")
-    with ThreadPoolExecutor() as executor:
-        structures = list(executor.map(extract_document_structure, pdf_paths))
+    # Parsing is CPU-bound, so the work is spread over processes rather than threads.
+    # Only paths cross the process boundary; fitz documents are opened in the worker.
+    if len(pdf_paths) > PER_PDF_THRESHOLD:
+        max_workers = min(len(pdf_paths), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # One PDF per task: the IPC is just a path in and a structure out, and larger
+            # chunks would leave workers idle (15 PDFs in chunks of 10 use only 2 of them)
+            structures = list(executor.map(extract_document_structure, pdf_paths))
+    else:
+        with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            structures = _extract_structures_by_page_range(pdf_paths, executor)
     
     print("\n--- Step 2: Running Hybrid Analysis ---")
     return run_hybrid_analysis(structures, persona, task)
@@ -1,11 +1,16 @@
 import os
+
+# Set before app (and with it torch) is imported
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
 import json
 import argparse
 from datetime import datetime
 
+import orjson
+
 # Import the functions from your main analysis script.
 import app as analyst
-os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 
 # --- Execution Logic ---
 
@@ -72,8 +77,8 @@ def run_analysis_for_collection(input_json_path: str):
         }
         
         print(f"\n💾 Saving final analysis to {output_json_path}...")
-        with open(output_json_path, "w") as f:
-            json.dump(final_output, f, indent=2)
+        with open(output_json_path, "wb") as f:
+            f.write(orjson.dumps(final_output, option=orjson.OPT_INDENT_2))
         
         print(f"Analysis completed in {processing_time}")
         print(f"Results saved to {output_json_path}")
@@ -93,15 +98,16 @@ if __name__ == "__main__":
 
     collection_found = False
     # Iterate over items in the current directory
-    for item_name in os.listdir(current_directory):
-        item_path = os.path.join(current_directory, item_name)
-        # Check if the item is a directory (e.g., "Collection 1")
-        if os.path.isdir(item_path):
-            input_json_path = os.path.join(item_path, "challenge1b_input.json")
-            # Check if the input JSON exists in this directory
-            if os.path.exists(input_json_path):
-                collection_found = True
-                run_analysis_for_collection(input_json_path)
+    with os.scandir(current_directory) as entries:
+        # Check if the item is a directory (e.g., "Collection 1"); the entry already knows its type
+        collection_dirs = [entry.path for entry in entries if entry.is_dir()]
+
+    for item_path in collection_dirs:
+        input_json_path = os.path.join(item_path, "challenge1b_input.json")
+        # Check if the input JSON exists in this directory
+        if os.path.exists(input_json_path):
+            collection_found = True
+            run_analysis_for_collection(input_json_path)
 
     if not collection_found:
         print("\n No collection directories containing 'challenge1b_input.json' were found.")
\ No newline at end of file